@@ -1,16 +1,32 @@
 from __future__ import annotations
+import argparse
+import asyncio
+import bisect
+import functools
+import hashlib
+import json
+import mmap
+import multiprocessing
 import os
 import re
 import sys
 import pathlib
-from typing import List, Dict, Optional
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Dict, Optional, Tuple
 
 try:
-    from groq import Groq
+    import httpx
+    from groq import APIError, AsyncGroq
 except ImportError:
     print("Please install groq → pip install groq")
     sys.exit(1)
 
+try:
+    import aiofiles
+except ImportError:
+    print("Please install aiofiles → pip install aiofiles")
+    sys.exit(1)
+
 # ------------------------
 # Load API Key
 # ------------------------
@@ -21,7 +37,34 @@ if not API_KEY:
 if not API_KEY:
     raise Exception("❌ Missing GROQ_API_KEY environment variable.")
 
-groq_client = Groq(api_key=API_KEY)
+GROQ_MODEL = "llama-3.1-8b-instant"
+# deterministic output, so identical prompts can be served from the cache
+GROQ_TEMPERATURE = 0
+
+# Upper bound on in-flight Groq requests (keeps us under the RPM limit)
+GROQ_CONCURRENCY = 20
+
+# One shared keep-alive pool, so concurrent requests reuse TLS connections
+# instead of paying a handshake per call
+groq_client = AsyncGroq(
+    api_key=API_KEY,
+    http_client=httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=50,
+            max_keepalive_connections=GROQ_CONCURRENCY,
+            keepalive_expiry=60.0,
+        ),
+        timeout=30.0,
+    ),
+)
+
+# Raw Groq responses keyed by prompt hash, reused across runs
+CACHE_DIR = pathlib.Path(".cache/groq")
+# One JSON line per finished source file, so interrupted runs can resume
+STATE_FILE = CACHE_DIR / "state.jsonl"
+
+# Seconds between status checks on a submitted Groq batch job
+BATCH_POLL_SECONDS = 30
 
 # ============================================================
 # Detection patterns
@@ -34,15 +77,27 @@ DB_PATTERNS = [
     r"EntityManager", r"Session", r"CriteriaQuery", r"TypedQuery",
     r"createQuery\(", r"createNativeQuery\("
 ]
+# lowercase literals at least one of which must appear for DB_PATTERNS to match;
+# keep these in step with the pattern lists when adding entries
+DB_TOKENS = (
+    "@repository", "@entity", "@table", "@column", "@id",
+    "jparepository", "crudrepository", "pagingandsortingrepository",
+    "mongorepository", "cassandrarepository",
+    "jdbctemplate", "namedparameterjdbctemplate",
+    "entitymanager", "session", "criteriaquery", "typedquery",
+    "createquery(", "createnativequery(",
+)
 
 JDBC_PATTERNS = [
     r"Connection\b", r"PreparedStatement\b", r"ResultSet\b",
     r"DriverManager", r"SQLException"
 ]
+JDBC_TOKENS = ("connection", "preparedstatement", "resultset", "drivermanager", "sqlexception")
 
 SQL_PATTERNS = [
     r"SELECT\s", r"INSERT\s", r"UPDATE\s", r"DELETE\s", r"WHERE\s", r"JOIN\s"
 ]
+SQL_TOKENS = ("select", "insert", "update", "delete", "where", "join")
 
 DEPENDENCY_PATTERNS = [
     r"@Autowired",
@@ -52,9 +107,28 @@ DEPENDENCY_PATTERNS = [
     r"private\s+[\w\<\>\.\[\]]+\s+\w+;",
 ]
 
-SPRING_SKIP_PATTERNS = (
-    r"@RestController|@Controller|@Configuration|@ComponentScan|@SpringBootApplication"
+# plain substrings, searched in the raw file bytes before anything is decoded
+SPRING_SKIP_TOKENS = (
+    "@RestController", "@Controller", "@Configuration", "@ComponentScan", "@SpringBootApplication"
 )
+SPRING_SKIP_BYTES = tuple(t.encode("utf-8") for t in SPRING_SKIP_TOKENS)
+
+
+def _union(patterns: List[str], flags: int = 0) -> re.Pattern:
+    # one alternation lets the engine walk the text once instead of once per pattern
+    return re.compile("|".join(f"(?:{p})" for p in patterns), flags)
+
+
+# compiled once at import; detection is case-insensitive, method summaries are not
+DB_UNION = _union(DB_PATTERNS, re.IGNORECASE)
+JDBC_UNION = _union(JDBC_PATTERNS, re.IGNORECASE)
+SQL_UNION = _union(SQL_PATTERNS, re.IGNORECASE)
+ALL_DB_UNION = _union(DB_PATTERNS + JDBC_PATTERNS + SQL_PATTERNS)
+DEPENDENCY_RE = [re.compile(p) for p in DEPENDENCY_PATTERNS]
+
+PKG_RE = re.compile(r"package\s+([\w\.]+);")
+CLASS_RE = re.compile(r"class\s+(\w+)")
+FIELD_RE = re.compile(r"(private|protected|public)\s+([\w\<\>\[\]]+)\s+(\w+)\s*;")
 
 # ============================================================
 # Method extraction
@@ -68,8 +142,14 @@ METHOD_SIG_RE = re.compile(
     re.MULTILINE
 )
 
+BRACE_RE = re.compile(r"[{}]")
+
 
 def extract_methods_with_bodies(code: str) -> List[Dict]:
+    # index every brace once so body matching jumps brace-to-brace, not char-by-char
+    braces = [(b.start(), b.group()) for b in BRACE_RE.finditer(code)]
+    brace_positions = [pos for pos, _ in braces]
+
     methods = []
     for m in METHOD_SIG_RE.finditer(code):
         brace_pos = code.find("{", m.end(0) - 1)
@@ -77,16 +157,15 @@ def extract_methods_with_bodies(code: str) -> List[Dict]:
             continue
 
         depth, end = 0, None
-        i = brace_pos
-        while i < len(code):
-            if code[i] == "{":
+        for i in range(bisect.bisect_left(brace_positions, brace_pos), len(braces)):
+            pos, ch = braces[i]
+            if ch == "{":
                 depth += 1
-            elif code[i] == "}":
+            else:
                 depth -= 1
                 if depth == 0:
-                    end = i + 1
+                    end = pos + 1
                     break
-            i += 1
 
         body = code[brace_pos:end] if end else "{ }"
         methods.append({
@@ -95,6 +174,8 @@ def extract_methods_with_bodies(code: str) -> List[Dict]:
             "name": m.group("name"),
             "params": m.group("params").strip(),
             "body": body.strip(),
+            "body_start": brace_pos,
+            "body_end": end,
         })
 
     return methods
@@ -103,40 +184,56 @@ def extract_methods_with_bodies(code: str) -> List[Dict]:
 # ============================================================
 # Classify and dependency detection
 # ============================================================
+@functools.lru_cache(maxsize=1)
+def analyze_source(code: str) -> Dict:
+    """
+    Scan a Java source once and collect everything the dependency detectors need.
+    A file's detectors run back to back, so caching the latest source is enough.
+    """
+    class_match = CLASS_RE.search(code)
+    class_name = class_match.group(1) if class_match else None
+
+    ctor_params = None
+    if class_name:
+        ctor_match = re.search(rf"public\s+{class_name}\s*\(([^)]*)\)", code)
+        if ctor_match:
+            ctor_params = ctor_match.group(1)
+
+    return {
+        "class_name": class_name,
+        "ctor_params": ctor_params,
+        "has_deps": any(p.search(code) for p in DEPENDENCY_RE),
+    }
+
+
 def detect_constructor_injection(code: str) -> bool:
-    class_name = re.search(r"class\s+(\w+)", code)
-    if not class_name:
-        return False
-    c = class_name.group(1)
-    ctor_pattern = re.compile(rf"public\s+{c}\s*\(([^)]*)\)", re.MULTILINE)
-    match = ctor_pattern.search(code)
-    if match:
-        params = match.group(1)
-        return bool(params.strip())
-    return False
+    params = analyze_source(code)["ctor_params"]
+    return bool(params and params.strip())
 
 
 def detect_dependencies(code: str) -> bool:
-    return any(re.search(p, code) for p in DEPENDENCY_PATTERNS)
+    return analyze_source(code)["has_deps"]
 
 
 def detect_db_type(code: str) -> Optional[str]:
-    if any(re.search(p, code, re.IGNORECASE) for p in DB_PATTERNS):
+    # substring checks reject most files before the case-insensitive regexes run,
+    # and the first category that matches ends the scan
+    lowered = code.lower()
+    if any(t in lowered for t in DB_TOKENS) and DB_UNION.search(code):
         return "JPA"
-    if any(re.search(p, code, re.IGNORECASE) for p in JDBC_PATTERNS):
+    if any(t in lowered for t in JDBC_TOKENS) and JDBC_UNION.search(code):
         return "JDBC"
-    if any(re.search(p, code, re.IGNORECASE) for p in SQL_PATTERNS):
+    if any(t in lowered for t in SQL_TOKENS) and SQL_UNION.search(code):
         return "SQL"
     return None
 
 
 def classify_class(code: str) -> tuple:
+    # a DB match decides the type on its own, so skip the dependency scans
     db = detect_db_type(code)
-    has_dep = detect_dependencies(code)
-    ctor_dep = detect_constructor_injection(code)
     if db:
         return "DB", db
-    if ctor_dep or has_dep:
+    if detect_dependencies(code) or detect_constructor_injection(code):
         return "SERVICE", ""
     return "PURE", ""
 
@@ -144,22 +241,30 @@ def classify_class(code: str) -> tuple:
 # ============================================================
 # Simple analyzers for prompting
 # ============================================================
+IF_RE = re.compile(r"\bif\b")
+SWITCH_RE = re.compile(r"\bswitch\b")
+LOOP_RE = re.compile(r"\bfor\b|\bwhile\b|\bdo\b")
+THROW_RE = re.compile(r"throw\s+new")
+NULL_RE = re.compile(r"\bnull\b")
+STATIC_CALL_RE = re.compile(r"[A-Z]\w+\.")
+
+
 def summarize_method_logic(method: Dict) -> str:
     body = method["body"]
     notes = []
-    if re.search(r"\bif\b", body):
+    if IF_RE.search(body):
         notes.append("conditionals")
-    if re.search(r"\bswitch\b", body):
+    if SWITCH_RE.search(body):
         notes.append("switch")
-    if re.search(r"\bfor\b|\bwhile\b|\bdo\b", body):
+    if LOOP_RE.search(body):
         notes.append("loops")
-    if re.search(r"throw\s+new", body):
+    if THROW_RE.search(body):
         notes.append("throws")
-    if re.search(r"\bnull\b", body):
+    if NULL_RE.search(body):
         notes.append("null checks")
-    if any(re.search(p, body) for p in DB_PATTERNS + JDBC_PATTERNS + SQL_PATTERNS):
+    if ALL_DB_UNION.search(body):
         notes.append("DB interactions")
-    if re.search(r"[A-Z]\w+\.", body):
+    if STATIC_CALL_RE.search(body):
         notes.append("dependency calls")
     return "; ".join(notes) if notes else "simple logic"
 
@@ -168,27 +273,23 @@ def summarize_method_logic(method: Dict) -> str:
 # Dependencies extraction
 # ============================================================
 def extract_class_dependencies(code: str) -> List[str]:
+    info = analyze_source(code)
     deps = set()
     # field injection detection: look for lines like "private SomeDep dep;"
-    for match in re.finditer(r"(private|protected|public)\s+([\w\<\>\[\]]+)\s+(\w+)\s*;", code):
+    for match in FIELD_RE.finditer(code):
         type_name = match.group(2)
         # avoid primitive types and the class itself later
         if type_name not in ("int", "long", "double", "float", "boolean", "char", "byte", "short"):
             deps.add(type_name)
     # constructor params
-    class_name = re.search(r"class\s+(\w+)", code)
-    if class_name:
-        c = class_name.group(1)
-        ctor_match = re.search(rf"public\s+{c}\s*\(([^)]*)\)", code, re.MULTILINE)
-        if ctor_match:
-            params = ctor_match.group(1).split(",")
-            for p in params:
-                p = p.strip()
-                if not p:
-                    continue
-                parts = p.split()
-                if len(parts) >= 2:
-                    deps.add(parts[0])
+    if info["ctor_params"] is not None:
+        for p in info["ctor_params"].split(","):
+            p = p.strip()
+            if not p:
+                continue
+            parts = p.split()
+            if len(parts) >= 2:
+                deps.add(parts[0])
     return sorted(deps)
 
 
@@ -210,17 +311,69 @@ IMPORT_MAP = {
     "List": "import java.util.List;",
 }
 
+# one alternation finds every IMPORT_MAP token in a single scan of the body
+IMPORT_TOKEN_RE = re.compile(r"\b(" + "|".join(map(re.escape, IMPORT_MAP)) + r")\b")
+
+# imports never added for PURE classes
+MOCKITO_KEYS = frozenset({"Mock", "Mockito", "InjectMocks", "MockitoExtension", "ExtendWith"})
+
 DEFAULT_TEST_IMPORTS = [
     "import org.junit.jupiter.api.Test;",
     "import static org.junit.jupiter.api.Assertions.*;"
 ]
 
 
+# Larger sources are sent as an outline plus (truncated) method bodies instead
+# of the full file, which keeps input tokens and time-to-first-token down
+FULL_SOURCE_LIMIT = 4000
+METHOD_BODY_LIMIT = 1500
+
+COMMENT_RE = re.compile(
+    r'("""[\s\S]*?"""|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\')'
+    r"|//.*|/\*[\s\S]*?\*/"
+)
+# every line boundary str.splitlines() knows, folded to "\n" before the subs below
+LINE_BREAK_RE = re.compile("\r\n|[\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]")
+# blank lines and trailing whitespace, removed with one sub instead of split/join
+BLANK_LINE_RE = re.compile(r"^[^\S\n]*(?:\n|\Z)|[^\S\n]+$", re.MULTILINE)
+BLANK_OR_IMPORT_LINE_RE = re.compile(r"^[^\S\n]*(?:import [^\n]*)?(?:\n|\Z)|[^\S\n]+$", re.MULTILINE)
+
+
+def outline_source(java_code: str, methods: List[Dict]) -> str:
+    """
+    Elide the bodies of the given methods (they travel with the method summaries)
+    and drop comments and blank lines, keeping imports, annotations, fields,
+    constructors and helper methods intact.
+    """
+    # splice by each body's own span (not by its text, which may repeat), skipping
+    # unterminated methods and spans nested inside one already elided
+    pieces, pos = [], 0
+    spans = sorted((m["body_start"], m["body_end"]) for m in methods if m["body_end"] is not None)
+    for start, end in spans:
+        if start < pos:
+            continue
+        pieces.append(java_code[pos:start])
+        pieces.append("{ ... }")
+        pos = end
+    pieces.append(java_code[pos:])
+    outline = "".join(pieces)
+    # string and char literals are matched first and kept, so "jdbc:mysql://..." survives
+    outline = COMMENT_RE.sub(lambda m: m.group(1) or "", outline)
+    return BLANK_LINE_RE.sub("", LINE_BREAK_RE.sub("\n", outline)).rstrip("\n")
+
+
 def build_prompt(java_code, class_name, package_name, class_type, db_type, methods):
-    method_summary = "\n".join(
-        f"- {m['modifiers']} {m['return']} {m['name']}({m['params']}): {summarize_method_logic(m)}"
-        for m in methods
-    )
+    trimmed = len(java_code) >= FULL_SOURCE_LIMIT
+
+    summaries = []
+    for m in methods:
+        summary = f"- {m['modifiers']} {m['return']} {m['name']}({m['params']}): {summarize_method_logic(m)}"
+        if trimmed:
+            summary += "\n" + m["body"][:METHOD_BODY_LIMIT]
+        summaries.append(summary)
+    method_summary = "\n".join(summaries)
+
+    source = outline_source(java_code, methods) if trimmed else java_code
 
     if class_type == "PURE":
         strategy = (
@@ -249,7 +402,7 @@ Method summaries:
 {strategy}
 
 Source:
-{java_code}
+{source}
 """
     return prompt
 
@@ -257,15 +410,16 @@ Source:
 # ============================================================
 # Groq call + postprocessing
 # ============================================================
+FENCE_OR_COMMENT_RE = re.compile(r"^```(?:java)?|```|//.*|/\*[\s\S]*?\*/", re.MULTILINE)
+
+
 def remove_code_comments(code: str) -> str:
-    # remove code fences and comments produced by LLM
-    code = re.sub(r"^```(?:java)?", "", code, flags=re.MULTILINE)
-    code = re.sub(r"```", "", code)
-    code = re.sub(r"//.*", "", code)
-    code = re.sub(r"/\*[\s\S]*?\*/", "", code)
-    # remove blank lines
-    code = "\n".join([ln.rstrip() for ln in code.splitlines() if ln.strip()])
-    return code
+    # remove code fences and comments produced by LLM in a single pass;
+    # the blank lines left behind are dropped by add_missing_imports
+    return FENCE_OR_COMMENT_RE.sub("", code)
+
+
+EXTEND_WITH_MOCKITO_RE = re.compile(r"@ExtendWith\s*\(\s*MockitoExtension\.class\s*\)\s*")
 
 
 def ensure_pure_instantiation(code: str, class_name: str) -> str:
@@ -274,7 +428,7 @@ def ensure_pure_instantiation(code: str, class_name: str) -> str:
     ensure the test class instantiates the class under test directly.
     """
     # remove @ExtendWith(MockitoExtension.class)
-    code = re.sub(r"@ExtendWith\s*\(\s*MockitoExtension\.class\s*\)\s*", "", code)
+    code = EXTEND_WITH_MOCKITO_RE.sub("", code)
 
     # remove fields annotated with @Mock that match class_name
     code = re.sub(rf"@Mock\s+private\s+{re.escape(class_name)}\s+\w+\s*;\s*", "", code)
@@ -299,12 +453,10 @@ def ensure_pure_instantiation(code: str, class_name: str) -> str:
 def add_missing_imports(code: str, class_name: str, package_name: str, class_type: str) -> str:
     """
     Build import block, dedupe, and prevent adding Mockito imports for pure classes.
-    Also remove any existing import lines from code body to avoid duplicates.
+    Also remove any existing import lines and blank lines from the code body.
     """
-    # strip existing import lines from code body
-    code_lines = code.splitlines()
-    code_without_imports = "\n".join([ln for ln in code_lines if not ln.strip().startswith("import ")])
-    code_body = code_without_imports.strip()
+    # single pass over the body: drop blank and import lines
+    body = BLANK_OR_IMPORT_LINE_RE.sub("", LINE_BREAK_RE.sub("\n", code)).rstrip("\n")
 
     needed = set()
 
@@ -313,47 +465,154 @@ def add_missing_imports(code: str, class_name: str, package_name: str, class_typ
         # class under test normally lives in package_name (not tests subpackage)
         needed.add(f"import {package_name}.{class_name};")
 
-    # scan code body for tokens and map to imports
-    for key, imp in IMPORT_MAP.items():
-        # skip Mockito imports for pure classes
-        if key in ("Mock", "Mockito", "InjectMocks", "MockitoExtension", "ExtendWith") and class_type == "PURE":
+    # scan code body once for tokens and map to imports,
+    # skipping Mockito imports for pure classes
+    for key in set(IMPORT_TOKEN_RE.findall(body)):
+        if class_type == "PURE" and key in MOCKITO_KEYS:
             continue
-        # add import if key appears as a word in code body
-        if re.search(rf"\b{re.escape(key)}\b", code_body):
-            needed.add(imp)
+        needed.add(IMPORT_MAP[key])
 
     # always add default test imports
     for imp in DEFAULT_TEST_IMPORTS:
         needed.add(imp)
 
-    import_block = "\n".join(sorted(needed))
+    parts = [f"package {package_name}.tests;"] if package_name else []
+    parts.extend(sorted(needed))
+    if body:
+        parts.append(body)
+    return "\n".join(parts)
 
-    pkg_line = f"package {package_name}.tests;" if package_name else ""
-    final_parts = [p for p in (pkg_line, import_block, code_body) if p]
-    final = "\n\n".join(final_parts)
-    # tidy up
-    final = "\n".join([ln.rstrip() for ln in final.splitlines() if ln.strip()])
-    return final
 
+def cache_path(prompt: str) -> pathlib.Path:
+    key = hashlib.sha256(f"{GROQ_MODEL}:{GROQ_TEMPERATURE}:{prompt}".encode("utf-8")).hexdigest()
+    return CACHE_DIR / f"{key}.txt"
 
-def generate_test(java_code, class_name, package, class_type, db_type, methods):
-    prompt = build_prompt(java_code, class_name, package, class_type, db_type, methods)
 
-    response = groq_client.chat.completions.create(
-        model="llama-3.1-8b-instant",
-        temperature=0.2,
-        max_tokens=4096,
-        messages=[{"role": "user", "content": prompt}],
+def is_cached(path: pathlib.Path) -> bool:
+    # a zero-byte blob is never a valid answer, so treat it as a miss
+    return path.exists() and path.stat().st_size > 0
+
+
+async def write_cache(path: pathlib.Path, content: str):
+    # write beside the target and swap it in, so a killed run never leaves a
+    # partial blob that later runs would serve as a hit
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    await write_file(str(tmp), content)
+    os.replace(tmp, path)
+
+
+def completion_params(prompt: str) -> Dict:
+    return {
+        "model": GROQ_MODEL,
+        "temperature": GROQ_TEMPERATURE,
+        "max_tokens": 4096,
+        "messages": [{"role": "user", "content": prompt}],
+    }
+
+
+# Requests currently in flight, keyed by cache path, so identical prompts
+# issued within one run share a single Groq call
+inflight: Dict[pathlib.Path, asyncio.Future] = {}
+
+
+async def complete(prompt: str, semaphore: asyncio.Semaphore, use_cache: bool = True) -> str:
+    """
+    Return the raw Groq completion for a prompt, served from the on-disk cache
+    when available. Fresh responses are always written back to the cache.
+    """
+    cached = cache_path(prompt)
+    if use_cache and is_cached(cached):
+        return read_file(str(cached))
+
+    task = inflight.get(cached)
+    if task is None:
+        task = asyncio.ensure_future(fetch_completion(prompt, semaphore))
+        inflight[cached] = task
+        task.add_done_callback(lambda _: inflight.pop(cached, None))
+    return await task
+
+
+async def fetch_completion(prompt: str, semaphore: asyncio.Semaphore) -> str:
+    cached = cache_path(prompt)
+
+    # stream tokens as they are decoded instead of waiting on one large body;
+    # post-processing needs the full text, so chunks are joined at the end
+    chunks = []
+    async with semaphore:
+        stream = await groq_client.chat.completions.create(**completion_params(prompt), stream=True)
+        async for chunk in stream:
+            if chunk.choices:
+                chunks.append(chunk.choices[0].delta.content or "")
+
+    content = "".join(chunks)
+    if not content.strip():
+        # not cached, so the next run asks again
+        raise Exception("Groq returned an empty response")
+    await write_cache(cached, content)
+    return content
+
+
+async def prefetch_batch(prompts: Dict[str, str], use_cache: bool = True) -> bool:
+    """
+    Submit prompts (keyed by custom id) as one Groq batch job and store the
+    completions in the response cache, where complete() picks them up.
+    Returns False if the batch did not complete; anything the batch does not
+    answer falls through to the real-time API.
+    """
+    pending = {cid: p for cid, p in prompts.items() if not (use_cache and is_cached(cache_path(p)))}
+    if not pending:
+        return True
+
+    batch_file = CACHE_DIR / "batch.jsonl"
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    await write_file(str(batch_file), "".join(
+        json.dumps({"custom_id": cid, "method": "POST", "url": "/v1/chat/completions",
+                    "body": completion_params(p)}) + "\n"
+        for cid, p in pending.items()
+    ))
+
+    upload = await groq_client.files.create(file=(batch_file.name, batch_file.read_bytes()), purpose="batch")
+    batch = await groq_client.batches.create(
+        completion_window="24h",
+        endpoint="/v1/chat/completions",
+        input_file_id=upload.id,
     )
+    print(f"Submitted batch {batch.id} with {len(pending)} prompts")
+
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        await asyncio.sleep(BATCH_POLL_SECONDS)
+        batch = await groq_client.batches.retrieve(batch.id)
 
-    content = response.choices[0].message.content or ""
+    if batch.status != "completed" or not batch.output_file_id:
+        print(f"Batch {batch.id} ended as {batch.status}, using the real-time API instead")
+        return False
+
+    output = await groq_client.files.content(batch.output_file_id)
+    for line in (await output.text()).splitlines():
+        result = json.loads(line)
+        response = result.get("response") or {}
+        if response.get("status_code") != 200:
+            continue
+        content = response["body"]["choices"][0]["message"]["content"] or ""
+        if content.strip():
+            await write_cache(cache_path(pending[result["custom_id"]]), content)
+    return True
+
+
+async def generate_test(java_code, class_name, package, class_type, db_type, methods,
+                        semaphore: asyncio.Semaphore, use_cache: bool = True):
+    prompt = build_prompt(java_code, class_name, package, class_type, db_type, methods)
+    print(f"{class_name}: prompt size {len(prompt)} chars")
+
+    content = await complete(prompt, semaphore, use_cache)
     content = remove_code_comments(content)
     # If the class is pure remove mocking and add direct instantiation
     if class_type == "PURE":
         content = ensure_pure_instantiation(content, class_name)
 
     # Add imports and return
-    return add_missing_imports(content.strip(), class_name, package, class_type)
+    return add_missing_imports(content, class_name, package, class_type)
 
 
 # ============================================================
@@ -364,53 +623,205 @@ def read_file(path: str) -> str:
         return fh.read()
 
 
-def write_file(path: str, content: str):
-    with open(path, "w", encoding="utf-8") as fh:
-        fh.write(content)
+def map_file(path: str) -> mmap.mmap:
+    # read-only mapping: callers can search the raw bytes without decoding them
+    with open(path, "rb") as fh:
+        return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
 
 
-def process_java_files(root_dir: str = "src/main/java"):
-    print("Scanning for Java files...")
+async def write_file(path: str, content: str):
+    # async so a slow disk never stalls the Groq requests sharing the event loop
+    async with aiofiles.open(path, "w", encoding="utf-8") as fh:
+        await fh.write(content)
 
-    for root, _, files in os.walk(root_dir):
-        for file in files:
-            if not file.endswith(".java"):
-                continue
 
-            path = os.path.join(root, file)
-            code = read_file(path)
+def test_output_dir(pkg: str) -> pathlib.Path:
+    return pathlib.Path("src/test/java") / pathlib.Path(*pkg.split("."), "tests")
 
-            if re.search(SPRING_SKIP_PATTERNS, code):
-                print(f"Skipping controller/config: {file}")
-                continue
 
-            class_name = file[:-5]
-            pkg_match = re.search(r"package\s+([\w\.]+);", code)
-            pkg = pkg_match.group(1) if pkg_match else ""
+def iter_java_files(root_dir: str) -> Iterator[str]:
+    # scandir hands back the entry type with each name, so no extra stat per file
+    stack = [root_dir]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            # missing or unreadable directory: skip it, as os.walk did
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(".java"):
+                    yield entry.path
 
-            class_type, db_type = classify_class(code)
-            print(f"{class_name}: Type → {class_type} {db_type or ''}")
 
-            methods = extract_methods_with_bodies(code)
-            methods = [m for m in methods if m["modifiers"] == "public"]
+def source_hash(code: str) -> str:
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()
 
-            if not methods:
-                print(f"No public methods found in {class_name}")
-                continue
 
-            test_code = generate_test(code, class_name, pkg, class_type, db_type, methods)
+def load_state() -> set:
+    """
+    Return the (path, sha256) pairs finished by earlier runs whose test file
+    still exists.
+    """
+    done = set()
+    if not STATE_FILE.exists():
+        return done
+    for line in read_file(str(STATE_FILE)).splitlines():
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            # torn last line from an interrupted run
+            continue
+        if os.path.exists(entry["output"]):
+            done.add((entry["path"], entry["sha256"]))
+    return done
+
+
+def record_done(path: str, sha256: str, output_file: str):
+    # a single short append per entry, written from the event loop only
+    STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(STATE_FILE, "a", encoding="utf-8") as fh:
+        fh.write(json.dumps({"path": path, "sha256": sha256, "output": output_file}) + "\n")
+
+
+def analyze_file(path: str) -> Tuple[List[str], Optional[tuple]]:
+    """
+    CPU-bound half of the pipeline: read, classify and extract public methods.
+    Runs in worker processes, so it only takes and returns picklable values.
+    Returns the log lines for the file and its job tuple (None if skipped).
+    """
+    file = os.path.basename(path)
+
+    # check the raw bytes first, so skipped files are never decoded
+    code = ""
+    if os.path.getsize(path):
+        with map_file(path) as data:
+            if any(data.find(t) != -1 for t in SPRING_SKIP_BYTES):
+                return [f"Skipping controller/config: {file}"], None
+            code = str(data, "utf-8")
+        # match the universal-newline handling of text-mode reads
+        if "\r" in code:
+            code = code.replace("\r\n", "\n").replace("\r", "\n")
+
+    class_name = file[:-5]
+    pkg_match = PKG_RE.search(code)
+    pkg = pkg_match.group(1) if pkg_match else ""
+
+    class_type, db_type = classify_class(code)
+    log = [f"{class_name}: Type → {class_type} {db_type or ''}"]
 
-            output_dir = pathlib.Path("src/test/java") / pathlib.Path(*pkg.split("."), "tests")
-            output_dir.mkdir(parents=True, exist_ok=True)
+    methods = extract_methods_with_bodies(code)
+    methods = [m for m in methods if m["modifiers"] == "public"]
 
-            output_file = output_dir / f"{class_name}Test.java"
-            write_file(str(output_file), test_code)
+    if not methods:
+        log.append(f"No public methods found in {class_name}")
+        return log, None
 
-            print(f"Created test: {output_file}")
+    return log, (path, code, class_name, pkg, class_type, db_type, methods)
+
+
+async def call_and_write(job: tuple, semaphore: asyncio.Semaphore, use_cache: bool = True):
+    """IO-bound half of the pipeline: fetch the test from Groq and write it out."""
+    path, code, class_name, pkg, class_type, db_type, methods = job
+    test_code = await generate_test(code, class_name, pkg, class_type, db_type, methods, semaphore, use_cache)
+
+    output_file = test_output_dir(pkg) / f"{class_name}Test.java"
+    await write_file(str(output_file), test_code)
+    record_done(path, source_hash(code), str(output_file))
+
+    print(f"Created test: {output_file}")
+
+
+def worker_context():
+    # forked workers inherit the already-compiled module patterns; where fork is
+    # not safe (Windows, macOS) each spawned worker re-imports this module once
+    # and compiles them there, before its first task
+    return multiprocessing.get_context("fork" if sys.platform.startswith("linux") else None)
+
+
+async def process_java_files(root_dir: str = "src/main/java", use_cache: bool = True, force: bool = False,
+                             batch: bool = False):
+    print("Scanning for Java files...")
+
+    # fresh answers mean regenerating finished files too, so --no-cache implies --force
+    done = set() if force or not use_cache else load_state()
+
+    paths = list(iter_java_files(root_dir))
+
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(GROQ_CONCURRENCY)
+    output_dirs = set()
+    jobs, tasks = [], []
+
+    def start(job: tuple):
+        # create each output directory once, before any write into it is scheduled
+        pkg = job[3]
+        if pkg not in output_dirs:
+            test_output_dir(pkg).mkdir(parents=True, exist_ok=True)
+            output_dirs.add(pkg)
+        tasks.append(asyncio.ensure_future(call_and_write(job, semaphore, use_cache)))
+
+    # regex scanning is CPU-bound, so spread it over processes rather than threads;
+    # each worker reads its own files, which also overlaps the disk reads. Results
+    # are awaited off the event loop, so a file's Groq request starts as soon as
+    # its analysis is done (batch mode needs every prompt first, so it waits)
+    pool = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=worker_context())
+
+    async def analyze(path: str) -> Tuple[List[str], Optional[tuple]]:
+        # a bad file (undecodable, deleted since discovery) must not abort the
+        # run and cancel Groq requests already in flight
+        try:
+            return await loop.run_in_executor(pool, analyze_file, path)
+        except Exception as e:
+            return [f"❌ Failed to analyze {path}: {e}"], None
+
+    try:
+        analyses = [analyze(path) for path in paths]
+        for analysis in asyncio.as_completed(analyses):
+            log, job = await analysis
+            for line in log:
+                print(line)
+            if job is None:
+                continue
+            path, code, class_name = job[:3]
+            if (path, source_hash(code)) in done:
+                print(f"Unchanged since last run, skipping: {class_name}")
+                continue
+            jobs.append(job)
+            if not batch:
+                start(job)
+    finally:
+        # on Ctrl-C, drop queued analysis instead of finishing it first
+        pool.shutdown(cancel_futures=True)
+
+    if batch and jobs:
+        try:
+            if await prefetch_batch({job[0]: build_prompt(*job[1:]) for job in jobs}, use_cache):
+                # batch results were just written to the cache, so read them from there
+                use_cache = True
+        except APIError as e:
+            print(f"❌ Batch submission failed ({e}), using the real-time API instead")
+        for job in jobs:
+            start(job)
+
+    # requests and output writes run concurrently, bounded by the semaphore
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    for job, error in zip(jobs, results):
+        if isinstance(error, BaseException):
+            print(f"❌ Failed to generate test for {job[2]}: {error}")
 
     print("\nAll test classes generated.")
 
 
 if __name__ == "__main__":
-    src = sys.argv[1] if len(sys.argv) > 1 else "src/main/java"
-    process_java_files(src)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Generate JUnit5 tests for Java sources using Groq.")
+    parser.add_argument("src", nargs="?", default="src/main/java", help="root of the Java sources")
+    parser.add_argument("--no-cache", action="store_true", help="ignore cached Groq responses and regenerate every file")
+    parser.add_argument("--force", action="store_true", help="regenerate files finished by earlier runs (reusing cached responses)")
+    parser.add_argument("--batch", action="store_true",
+                        help="send prompts as one Groq batch job (cheaper, but can take hours)")
+    args = parser.parse_args()
+    asyncio.run(process_java_files(args.src, use_cache=not args.no_cache, force=args.force, batch=args.batch))